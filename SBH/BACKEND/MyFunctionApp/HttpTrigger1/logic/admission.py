@@ -0,0 +1,232 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# (max concurrent, max waiting, min free memory in MB) per action
+# Sum of concurrent + waiting must stay below maxConcurrentRequests in host.json
+DEFAULT_LIMITS = {
+    "pdfcsv": (2, 4, 1024),     # gmft models, CPU and memory heavy
+    "imgtocsv": (8, 16, 256),   # waits on the Gemini API
+    "mergecsv": (4, 8, 256),    # pandas file I/O
+}
+
+# cgroup v2 and v1 files for the container's memory limit, usage and reclaimable page cache
+CGROUP_FILES = [
+    ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current",
+     "/sys/fs/cgroup/memory.stat", "inactive_file"),
+    ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+     "/sys/fs/cgroup/memory/memory.stat", "total_inactive_file"),
+]
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request should be answered with 429"""
+    def __init__(self, action, reason, retry_after):
+        super().__init__(f"{action} rejected: {reason}")
+        self.action = action
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _read_int(path):
+    with open(path, "r") as f:
+        value = f.read().strip()
+    return None if value == "max" else int(value)
+
+
+def _read_stat(path, key):
+    """One counter from a cgroup memory.stat file, 0 if missing"""
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                name, _, value = line.partition(" ")
+                if name == key:
+                    return int(value)
+    except Exception:
+        pass
+    return 0
+
+
+def cgroup_available_mb():
+    """Memory left under the container's cgroup limit, or None if there is no limit"""
+    for limit_file, usage_file, stat_file, inactive_key in CGROUP_FILES:
+        try:
+            limit = _read_int(limit_file)
+            usage = _read_int(usage_file)
+        except Exception:
+            continue
+        # v1 reports "no limit" as a huge number instead of "max"
+        if limit is None or limit >= 1 << 60:
+            return None
+        # Usage includes page cache the kernel can reclaim; compare the working set like kubelet
+        working_set = max(usage - _read_stat(stat_file, inactive_key), 0)
+        return max(limit - working_set, 0) / (1024 * 1024)
+    return None
+
+
+def meminfo_available_mb():
+    """MemAvailable from /proc/meminfo, or None where it can't be read"""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except Exception:
+        pass
+    return None
+
+
+def available_memory_mb():
+    """Free memory for this worker: the cgroup limit if set, else the host's MemAvailable"""
+    known = [mb for mb in (cgroup_available_mb(), meminfo_available_mb()) if mb is not None]
+    return min(known) if known else None
+
+
+class ActionPool:
+    """Concurrency slots and a bounded wait queue for one action"""
+    def __init__(self, action, concurrency, queue_depth, min_free_mb, queue_timeout):
+        self.action = action
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.min_free_mb = min_free_mb
+        self.queue_timeout = queue_timeout
+        self._slots = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.avg_service_s = 1.0
+        self.metrics = {
+            "admitted": 0,
+            "rejected_memory": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+        }
+
+    @property
+    def slots(self):
+        # Created on first use so it belongs to the worker's running event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return self._slots
+
+    def retry_after(self):
+        """Rough seconds until a queued request would get a slot"""
+        estimate = self.avg_service_s * (self.waiting + 1) / self.concurrency
+        return min(max(int(math.ceil(estimate)), 1), 60)
+
+    def reject(self, reason, metric, retry_after):
+        self.metrics[metric] += 1
+        logging.warning(f" Admission rejected {self.action}: {reason}")
+        raise AdmissionRejected(self.action, reason, retry_after)
+
+    def check_memory(self):
+        free_mb = available_memory_mb()
+        if free_mb is not None and free_mb < self.min_free_mb:
+            self.reject(f"only {free_mb:.0f} MB memory available", "rejected_memory", 5)
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold a slot for the duration of the block, yields queue wait in ms"""
+        self.check_memory()
+
+        start = time.monotonic()
+        if self.slots.locked():
+            if self.waiting >= self.queue_depth:
+                self.reject("queue full", "rejected_queue_full", self.retry_after())
+            # Waiting on the event loop holds no worker thread
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.reject(f"no slot after {self.queue_timeout}s", "rejected_timeout", self.retry_after())
+            finally:
+                self.waiting -= 1
+        else:
+            await self.slots.acquire()
+
+        try:
+            # Memory may have run low while this request was queued
+            self.check_memory()
+        except AdmissionRejected:
+            self.slots.release()
+            raise
+
+        wait_ms = (time.monotonic() - start) * 1000
+        self.in_flight += 1
+        self.metrics["admitted"] += 1
+        self.metrics["total_wait_ms"] += wait_ms
+        self.metrics["max_wait_ms"] = max(self.metrics["max_wait_ms"], wait_ms)
+        if wait_ms >= 1:
+            logging.info(f" {self.action} waited {wait_ms:.0f} ms in queue")
+
+        service_start = time.monotonic()
+        try:
+            yield wait_ms
+        finally:
+            # Moving average of processing time, used for Retry-After
+            self.avg_service_s = 0.8 * self.avg_service_s + 0.2 * (time.monotonic() - service_start)
+            self.in_flight -= 1
+            self.slots.release()
+
+    def snapshot(self):
+        stats = dict(self.metrics)
+        stats.update({
+            "concurrency": self.concurrency,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "avg_wait_ms": stats["total_wait_ms"] / stats["admitted"] if stats["admitted"] else 0.0,
+            "avg_service_ms": self.avg_service_s * 1000,
+        })
+        return stats
+
+
+class AdmissionController:
+    """Per-action pools so heavy PDF requests can't starve cheap ones"""
+    def __init__(self, limits=None, queue_timeout=30):
+        self.pools = {
+            action: ActionPool(action, concurrency, queue_depth, min_free_mb, queue_timeout)
+            for action, (concurrency, queue_depth, min_free_mb) in (limits or DEFAULT_LIMITS).items()
+        }
+        # One thread per slot, so admitted work never waits for a thread
+        self.executor = ThreadPoolExecutor(
+            max_workers=sum(pool.concurrency for pool in self.pools.values()) or 1,
+            thread_name_prefix="admission"
+        )
+
+    @classmethod
+    def from_env(cls):
+        """
+        Read limits from environment variables, falling back to DEFAULT_LIMITS
+
+        e.g. ADMISSION_PDFCSV_CONCURRENCY=1, ADMISSION_PDFCSV_QUEUE=2,
+        ADMISSION_PDFCSV_MIN_FREE_MB=2048, ADMISSION_QUEUE_TIMEOUT=30
+        """
+        limits = {}
+        for action, (concurrency, queue_depth, min_free_mb) in DEFAULT_LIMITS.items():
+            prefix = f"ADMISSION_{action.upper()}_"
+            limits[action] = (
+                int(os.environ.get(prefix + "CONCURRENCY", concurrency)),
+                int(os.environ.get(prefix + "QUEUE", queue_depth)),
+                float(os.environ.get(prefix + "MIN_FREE_MB", min_free_mb)),
+            )
+        return cls(limits, queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 30)))
+
+    async def run(self, action, func, *args):
+        """
+        Run a blocking handler once the action's pool admits it
+
+        Returns:
+            Tuple of (handler result, queue wait in ms)
+        """
+        loop = asyncio.get_running_loop()
+        async with self.pools[action].admit() as wait_ms:
+            return await loop.run_in_executor(self.executor, func, *args), wait_ms
+
+    def snapshot(self):
+        return {action: pool.snapshot() for action, pool in self.pools.items()}
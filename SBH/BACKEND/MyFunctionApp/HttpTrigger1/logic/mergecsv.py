@@ -8,19 +8,30 @@
 
 import os
 import pandas as pd
+import numpy as np
 import json
 import shutil
 import re
 import google.generativeai as genai
 import logging
+from HttpTrigger1.logic.schemamatch import similarity_scores, align_columns
 
 class CSVMatcher:
-    def __init__(self, data_dir="data", output_dir="output"):
+    def __init__(self, data_dir="data", output_dir="output", match_threshold=None, key_columns=None):
         self.data_dir = data_dir
         self.output_dir = output_dir
         self.csv_data_dict = {}
+        self.schema_dict = {}
+        self.merge_stats = {}
+        # Minimum header-set similarity for two files to be considered the same schema
+        if match_threshold is None:
+            match_threshold = os.environ.get("SCHEMA_MATCH_THRESHOLD", 0.6)
+        self.match_threshold = float(match_threshold)
+        # Columns identifying one record (e.g. Roll Number + Subject); empty means whole-row dedup
+        self.key_columns = parse_key_columns(key_columns or os.environ.get("MERGE_KEY_COLUMNS"))
         self.ensure_directories()
         self.load_dictionary()
+        self.load_schemas()
 
         # Get API key from environment variables
         api_key = os.environ.get("GEMINI_API_KEY")
@@ -85,7 +96,9 @@ class CSVMatcher:
             val = str(data["value"]).strip()
 
             self.csv_data_dict[filename] = (col, val)
+            self.schema_dict[filename] = [str(c) for c in df.columns]
             self.save_dictionary()
+            self.save_schemas()
             logging.info(f" {filename} analyzed: {col} = {val}")
             return {"file": filename, "column": col, "value": val}
 
@@ -106,6 +119,7 @@ class CSVMatcher:
             if file_name in self.csv_data_dict:
                 logging.info(f" {file_name} already exists! Overwriting.")
                 del self.csv_data_dict[file_name]
+                self.schema_dict.pop(file_name, None)
 
             # Analyze the new file
             df = pd.read_csv(input_path)
@@ -117,12 +131,7 @@ class CSVMatcher:
                 return []
 
             # Find matches
-            current_col, current_val = self.csv_data_dict[file_name]
-            matches = [
-                f for f, (col, val) in self.csv_data_dict.items()
-                if f != file_name
-                and col.lower() == current_col.lower()
-            ]
+            matches = self.find_matches(file_name)
 
             # Merge/Add logic
             merged_files = []
@@ -143,18 +152,77 @@ class CSVMatcher:
             logging.error(f" Error: {str(e)}")
             raise
 
+    def find_matches(self, file_name):
+        """Files whose Gemini column or header set matches the given file"""
+        current_col, current_val = self.csv_data_dict[file_name]
+        current_headers = self.schema_dict.get(file_name, [])
+
+        cached = len(self.schema_dict)
+        schemas = {}
+        for f in self.csv_data_dict:
+            if f == file_name:
+                continue
+            headers = self.get_schema(f)
+            if headers:
+                schemas[f] = headers
+        if len(self.schema_dict) != cached:
+            self.save_schemas()
+
+        # One vectorized pass over all stored schemas
+        scores = similarity_scores(current_headers, schemas)
+
+        matches = []
+        for f, (col, val) in self.csv_data_dict.items():
+            if f == file_name:
+                continue
+            score = scores.get(f, 0.0)
+            if col.lower() == current_col.lower() or score >= self.match_threshold:
+                logging.info(f" {f} matched (schema similarity {score:.2f})")
+                matches.append(f)
+        return matches
+
+    def get_schema(self, file_name):
+        """Header list of a stored file, read from disk once if not cached"""
+        if file_name in self.schema_dict:
+            return self.schema_dict[file_name]
+        for folder in (self.data_dir, self.output_dir):
+            path = os.path.join(folder, file_name)
+            if os.path.exists(path):
+                try:
+                    headers = [str(c) for c in pd.read_csv(path, nrows=0).columns]
+                except Exception as e:
+                    logging.warning(f" Could not read header of {file_name}: {str(e)}")
+                    return []
+                self.schema_dict[file_name] = headers
+                return headers
+        return []
+
     def merge_files(self, new_file, existing_file_name):
         """Merge CSV files"""
         try:
             new_df = pd.read_csv(new_file)
             existing_path = os.path.join(self.data_dir, existing_file_name)
+            if not os.path.exists(existing_path):
+                existing_path = os.path.join(self.output_dir, existing_file_name)
             existing_df = pd.read_csv(existing_path)
 
+            # Rename fuzzy-matched headers so rows line up with the existing file
+            renames = align_columns(list(new_df.columns), list(existing_df.columns))
+            if renames:
+                logging.info(f" Aligned columns: {renames}")
+                new_df = new_df.rename(columns=renames)
+
             merged_name = f"merged_{existing_file_name}"
             merged_path = os.path.join(self.output_dir, merged_name)
 
-            # Remove duplicates
-            combined = pd.concat([existing_df, new_df]).drop_duplicates(keep='last')
+            if self.key_columns:
+                combined, stats = self.upsert_rows(existing_df, new_df)
+            else:
+                # Remove duplicates
+                combined = pd.concat([existing_df, new_df]).drop_duplicates(keep='last')
+                stats = {"mode": "full_row", "rows": len(combined)}
+            self.merge_stats[merged_path] = stats
+            logging.info(f" Merge stats: {stats}")
             combined.to_csv(merged_path, index=False)
             logging.info(f" New file created: {merged_path}")
 
@@ -166,11 +234,99 @@ class CSVMatcher:
             logging.error(f" Merge failed: {str(e)}")
             return None
 
+    def upsert_rows(self, existing_df, new_df):
+        """
+        Update existing records and insert new ones, matched on the key columns
+
+        Returns:
+            Tuple of (merged dataframe, stats dict)
+        """
+        keys = [c for c in self.key_columns if c in existing_df.columns and c in new_df.columns]
+        if len(keys) != len(self.key_columns):
+            missing = [c for c in self.key_columns if c not in keys]
+            logging.warning(f" Key columns {missing} not in both files, using whole-row dedup")
+            combined = pd.concat([existing_df, new_df]).drop_duplicates(keep='last')
+            return combined, {"mode": "full_row", "rows": len(combined)}
+
+        n_existing = len(existing_df)
+        combined = pd.concat([existing_df, new_df], ignore_index=True)
+
+        # Hash only the key columns; text form so 1507, 1507.0 and "1507" are the same key
+        key_frame = combined[keys].apply(key_text)
+        combined[keys] = key_frame
+        # Rows with a blank key (common in OCR output) are plain inserts, never collapsed
+        null_key = (key_frame.isna() | key_frame.eq("")).any(axis=1).to_numpy()
+        keyed = np.flatnonzero(~null_key)
+        key_hash = pd.util.hash_pandas_object(key_frame.iloc[keyed], index=False).to_numpy()
+        is_new = keyed >= n_existing
+        existing_pos, new_pos = keyed[~is_new], keyed[is_new]
+        existing_hash, new_hash = key_hash[~is_new], key_hash[is_new]
+
+        # Columns the new file lacks keep their old value on updated records
+        absent = [c for c in existing_df.columns if c not in new_df.columns]
+        if absent and len(keyed):
+            combined.loc[keyed, absent] = combined.iloc[keyed].groupby(key_hash, sort=False)[absent].ffill()
+
+        # Latest row per key wins, placed where the key first appeared
+        keep = np.ones(len(combined), dtype=bool)
+        keep[keyed] = ~pd.Series(key_hash).duplicated(keep='last').to_numpy()
+        first_pos = np.arange(len(combined))
+        first_pos[keyed] = pd.Series(keyed).groupby(key_hash, sort=False).transform('min').to_numpy()
+        order = np.argsort(first_pos[keep], kind='stable')
+        merged = combined[keep].iloc[order].reset_index(drop=True)
+
+        # Conflict statistics against the last existing row for each key
+        new_last = ~pd.Series(new_hash).duplicated(keep='last').to_numpy()
+        in_existing = pd.Series(new_hash).isin(existing_hash).to_numpy()
+        matched = new_last & in_existing
+
+        # Compared inside combined, where each column has one dtype, so 85 == 85.0
+        shared = [c for c in new_df.columns if c in existing_df.columns]
+        existing_keep = ~pd.Series(existing_hash).duplicated(keep='last').to_numpy()
+        last_existing = pd.Series(existing_pos[existing_keep], index=existing_hash[existing_keep])
+        old_rows = combined.iloc[last_existing.reindex(new_hash[matched]).to_numpy()][shared].reset_index(drop=True)
+        new_rows = combined.iloc[new_pos[matched]][shared].reset_index(drop=True)
+        changed = old_rows.ne(new_rows) & ~(old_rows.isna() & new_rows.isna())
+        updated = int(changed.any(axis=1).sum())
+
+        null_key_rows = int(null_key.sum())
+        if null_key_rows:
+            logging.warning(f" {null_key_rows} rows have a blank key column, kept as separate rows")
+
+        stats = {
+            "mode": "upsert",
+            "key_columns": keys,
+            "rows": len(merged),
+            "inserted": int((new_last & ~in_existing).sum()),
+            "updated": updated,
+            "unchanged": int(matched.sum()) - updated,
+            "null_key_rows": null_key_rows,
+            "duplicate_keys_in_new": int((~new_last).sum()),
+            "duplicate_keys_in_existing": int(pd.Series(existing_hash).duplicated().sum()),
+        }
+        return merged, stats
+
     def save_dictionary(self):
         """Save data"""
         with open(os.path.join(self.output_dir, "matches.json"), 'w') as f:
             json.dump(self.csv_data_dict, f, indent=2)
 
+    def save_schemas(self):
+        """Save header lists"""
+        with open(os.path.join(self.output_dir, "schemas.json"), 'w') as f:
+            json.dump(self.schema_dict, f, indent=2)
+
+    def load_schemas(self):
+        """Load saved header lists"""
+        schema_file = os.path.join(self.output_dir, "schemas.json")
+        if os.path.exists(schema_file):
+            try:
+                with open(schema_file, 'r') as f:
+                    self.schema_dict = json.load(f)
+                logging.info(f" Loaded {len(self.schema_dict)} schemas")
+            except:
+                logging.error(" Schemas could not be loaded")
+
     def load_dictionary(self):
         """Load saved data"""
         dict_file = os.path.join(self.output_dir, "matches.json")
@@ -182,6 +338,24 @@ class CSVMatcher:
             except:
                 logging.error(" JSON could not be loaded")
 
+def parse_key_columns(value):
+    """Accept a list or a comma-separated string of key column names"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(c).strip() for c in value if str(c).strip()]
+
+def key_text(column):
+    """Key values as stripped text; 1507.0 from a float column (blank cells) becomes 1507"""
+    def to_text(value):
+        if pd.isna(value):
+            return np.nan
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value).strip()
+    return column.map(to_text).astype(object)
+
 # Command-line interface - only used when running this file directly
 def main():
     """Main program"""
@@ -0,0 +1,247 @@
+import os
+import re
+import logging
+import zlib
+import difflib
+import threading
+import numpy as np
+
+# Words that carry no meaning for matching headers ("Name of Student" == "Student Name")
+STOP_WORDS = {"of", "the", "a", "an", "and", "in", "for", "to"}
+
+# Abbreviations on marksheets that mean "number" ("Roll No", "Roll #")
+NUMBER_WORDS = {"no", "num", "nbr"}
+
+# Optional local embedding model, e.g. SCHEMA_EMBEDDING_MODEL=all-MiniLM-L6-v2
+_embedding_model = None
+_embedding_failed = False
+
+# Column pairs less similar than this count as different columns, not a partial match
+COLUMN_MATCH_FLOOR = 0.5
+
+# N-grams are hashed into a fixed number of features so vectors can be cached
+NGRAM_FEATURES = 2048
+
+# Vectors per distinct header text, shared by all requests in this worker process
+CACHE_LIMIT = 50000
+_ngram_cache = {}
+_embedding_cache = {}
+_cache_lock = threading.Lock()
+
+
+def normalize_header(header):
+    """Lowercase a header, strip punctuation/OCR noise and return sorted tokens"""
+    text = str(header).lower().replace("#", " number ")
+    text = re.sub(r'[^a-z0-9]+', ' ', text)
+    tokens = ["number" if t in NUMBER_WORDS else t for t in text.split() if t not in STOP_WORDS]
+    return sorted(tokens)
+
+
+def header_text(header):
+    """One header as a normalized string ("Name of Student" -> "name student")"""
+    return " ".join(normalize_header(header))
+
+
+def char_ngrams(text, n=3):
+    """Character n-grams of every word, padded so short words still count"""
+    grams = []
+    for word in text.split():
+        padded = f" {word} "
+        grams += [padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))]
+    return grams
+
+
+def _row_normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def ngram_vectors(texts, n=3):
+    """Unit-length hashed character n-gram counts, one row per text (tolerates OCR typos)"""
+    matrix = np.zeros((len(texts), NGRAM_FEATURES), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for g in char_ngrams(text, n):
+            matrix[row, zlib.crc32(g.encode()) % NGRAM_FEATURES] += 1
+    return _row_normalize(matrix)
+
+
+def load_embedding_model():
+    """Load a local sentence-transformers model if configured, else None"""
+    global _embedding_model, _embedding_failed
+    model_name = os.environ.get("SCHEMA_EMBEDDING_MODEL")
+    if not model_name or _embedding_failed:
+        return None
+    if _embedding_model is None:
+        try:
+            from sentence_transformers import SentenceTransformer
+            _embedding_model = SentenceTransformer(model_name)
+            logging.info(f" Loaded embedding model: {model_name}")
+        except Exception as e:
+            logging.warning(f" Embedding model not available: {str(e)}")
+            _embedding_failed = True
+            return None
+    return _embedding_model
+
+
+def embedding_vectors(texts):
+    """Unit-length embeddings from the local model"""
+    return _row_normalize(np.asarray(load_embedding_model().encode(texts), dtype=np.float32))
+
+
+def cached_vectors(texts, cache, encode):
+    """Vectors for texts, encoding only those not seen by earlier requests"""
+    with _cache_lock:
+        missing = [t for t in dict.fromkeys(texts) if t not in cache]
+        if len(cache) + len(missing) > CACHE_LIMIT:
+            cache.clear()
+            missing = list(dict.fromkeys(texts))
+        if missing:
+            cache.update(zip(missing, encode(missing)))
+        return np.stack([cache[t] for t in texts])
+
+
+def similarity_scores(query_headers, schemas):
+    """
+    Score one header list against all stored schemas at once
+
+    Every header is compared with every stored header; each schema's score is
+    the average best-match similarity of its columns, taken in both directions,
+    so two marksheets sharing only Roll Number and Student Name don't match.
+
+    Args:
+        query_headers: Headers of the new CSV
+        schemas: Dict of filename -> header list
+
+    Returns:
+        Dict of filename -> similarity in [0, 1]
+    """
+    names = [n for n in schemas if schemas[n]]
+    if not names or not query_headers:
+        return {}
+
+    # Stored headers repeat across files, so each distinct header is vectorized once
+    # per process and reused by later requests
+    query_texts = [header_text(h) for h in query_headers]
+    unique = {}
+    column_ids = []
+    offsets = []
+    for n in names:
+        offsets.append(len(column_ids))
+        for h in schemas[n]:
+            column_ids.append(unique.setdefault(header_text(h), len(unique)))
+
+    texts = query_texts + list(unique)
+    q = len(query_texts)
+    vectors = cached_vectors(texts, _ngram_cache, ngram_vectors)
+    sim = vectors[:q] @ vectors[q:].T
+    if load_embedding_model() is not None:
+        embedded = cached_vectors(texts, _embedding_cache, embedding_vectors)
+        sim = np.maximum(sim, embedded[:q] @ embedded[q:].T)
+
+    # Query headers x every stored header, schema after schema
+    sim = np.clip(sim[:, column_ids], 0.0, 1.0)
+    sim[sim < COLUMN_MATCH_FLOOR] = 0.0
+    offsets = np.asarray(offsets)
+    counts = np.diff(np.append(offsets, len(column_ids)))
+
+    query_score = np.maximum.reduceat(sim, offsets, axis=1).mean(axis=0)
+    stored_score = np.add.reduceat(sim.max(axis=0), offsets) / counts
+    scores = (query_score + stored_score) / 2
+
+    return dict(zip(names, scores.tolist()))
+
+
+# Tokens that number a column rather than name it ("Term 2", "Paper II", "2nd Term")
+ORDINAL_WORDS = {"first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth"}
+ROMAN_NUMERAL = re.compile(r'^x{0,3}(ix|iv|v?i{0,3})$')
+
+
+def is_ordinal_token(token):
+    """Digits, 1st/2nd/..., first/second/... or a roman numeral up to XXXIX"""
+    return (token.isdigit()
+            or re.fullmatch(r'\d+(st|nd|rd|th)', token) is not None
+            or token in ORDINAL_WORDS
+            or ROMAN_NUMERAL.fullmatch(token) is not None)
+
+
+def split_header(header):
+    """Split normalized tokens into (word tokens, ordinal tokens); "marks2" -> marks, 2"""
+    words, ordinals = [], []
+    for token in normalize_header(header):
+        for part in re.findall(r'\d+(?:st|nd|rd|th)?|[a-z]+', token):
+            (ordinals if is_ordinal_token(part) else words).append(part)
+    return sorted(words), sorted(ordinals)
+
+
+def typo_match(words, target_words, cutoff):
+    """
+    Pair every word with a distinct target word, allowing small typos
+
+    Returns:
+        Average similarity of the pairs, or None if the word sets differ
+    """
+    if len(words) != len(target_words):
+        return None
+    remaining = list(target_words)
+    total = 0.0
+    for word in words:
+        if word in remaining:
+            remaining.remove(word)
+            total += 1.0
+            continue
+        close = difflib.get_close_matches(word, remaining, n=1, cutoff=cutoff)
+        if not close:
+            return None
+        remaining.remove(close[0])
+        total += difflib.SequenceMatcher(None, word, close[0]).ratio()
+    return total / len(words) if words else 1.0
+
+
+def align_columns(new_headers, existing_headers, cutoff=0.8):
+    """
+    Map headers of the new file onto existing header names
+
+    A header is only renamed when both have the same numbering tokens and the
+    same words up to typos, so "Studnet Name" -> "Student Name" but never
+    "Marks 2" -> "Marks 1" or "Paper II" -> "Paper I".
+
+    Returns:
+        Dict of new header -> existing header for renamed columns only
+    """
+    # Existing headers already present in the new file are never a rename target
+    available = {}
+    ambiguous = set()
+    for h in existing_headers:
+        if h in new_headers:
+            continue
+        key = " ".join(normalize_header(h))
+        if key in available or key in ambiguous:
+            logging.warning(f" Columns '{available.get(key, h)}' and '{h}' look identical, not renaming onto them")
+            available.pop(key, None)
+            ambiguous.add(key)
+            continue
+        available[key] = h
+
+    mapping = {}
+    for header in new_headers:
+        if header in existing_headers or not available:
+            continue
+        key = " ".join(normalize_header(header))
+        if key in ambiguous:
+            continue
+        if key not in available:
+            words, ordinals = split_header(header)
+            best, best_score = None, 0.0
+            for candidate, target in available.items():
+                target_words, target_ordinals = split_header(target)
+                if ordinals != target_ordinals:
+                    continue
+                score = typo_match(words, target_words, cutoff)
+                if score is not None and score > best_score:
+                    best, best_score = candidate, score
+            if best is None:
+                continue
+            key = best
+        mapping[header] = available.pop(key)
+    return mapping
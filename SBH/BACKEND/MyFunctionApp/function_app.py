@@ -6,11 +6,15 @@ import json
 from HttpTrigger1.logic.imgtocsv import image_to_csv_pipeline
 from HttpTrigger1.logic.pdfcsv import pdf_to_csv
 from HttpTrigger1.logic.mergecsv import CSVMatcher
+from HttpTrigger1.logic.admission import AdmissionController, AdmissionRejected
 
 app = func.FunctionApp()
 
+# Per-action concurrency pools, shared by all requests in this worker process
+admission = AdmissionController.from_env()
+
 @app.route(route="processData", auth_level=func.AuthLevel.FUNCTION)
-def process_data(req: func.HttpRequest) -> func.HttpResponse:
+async def process_data(req: func.HttpRequest) -> func.HttpResponse:
     logging.info(" Azure Function Triggered")
 
     # Handle CORS preflight requests
@@ -54,22 +58,41 @@ def process_data(req: func.HttpRequest) -> func.HttpResponse:
             headers={"Access-Control-Allow-Origin": "*"}
         )
 
-    try:
-        if action == 'imgtocsv':
-            return handle_imgtocsv(req, output_dir)
-        elif action == 'pdfcsv':
-            return handle_pdfcsv(req, output_dir)
-        elif action == 'mergecsv':
-            return handle_mergecsv(req, data_dir, output_dir)
-        else:
-            logging.warning(f" Invalid action parameter: {action}")
-            return func.HttpResponse(
-                json.dumps({"error": "Invalid action parameter"}),
-                status_code=400,
-                mimetype="application/json",
-                headers={"Access-Control-Allow-Origin": "*"}
-            )
+    if action == 'stats':
+        return func.HttpResponse(
+            json.dumps(admission.snapshot()),
+            mimetype="application/json",
+            headers={"Access-Control-Allow-Origin": "*"}
+        )
+
+    if action not in ('imgtocsv', 'pdfcsv', 'mergecsv'):
+        logging.warning(f" Invalid action parameter: {action}")
+        return func.HttpResponse(
+            json.dumps({"error": "Invalid action parameter"}),
+            status_code=400,
+            mimetype="application/json",
+            headers={"Access-Control-Allow-Origin": "*"}
+        )
 
+    try:
+        # Queued requests wait on the event loop; the handler runs on a pool thread
+        response, wait_ms = await admission.run(action, handle_action, action, req, data_dir, output_dir)
+        response.headers["X-Queue-Wait-Ms"] = str(int(wait_ms))
+        exposed = response.headers.get("Access-Control-Expose-Headers")
+        response.headers["Access-Control-Expose-Headers"] = f"{exposed}, X-Queue-Wait-Ms" if exposed else "X-Queue-Wait-Ms"
+        return response
+
+    except AdmissionRejected as e:
+        return func.HttpResponse(
+            json.dumps({"error": f"Server busy, retry later ({e.reason})"}),
+            status_code=429,
+            mimetype="application/json",
+            headers={
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Expose-Headers": "Retry-After",
+                "Retry-After": str(e.retry_after)
+            }
+        )
     except Exception as e:
         logging.error(f" Exception occurred: {e}")
         return func.HttpResponse(
@@ -79,6 +102,15 @@ def process_data(req: func.HttpRequest) -> func.HttpResponse:
             headers={"Access-Control-Allow-Origin": "*"}
         )
 
+def handle_action(action: str, req: func.HttpRequest, data_dir: str, output_dir: str) -> func.HttpResponse:
+    """Run the handler for a validated action"""
+    if action == 'imgtocsv':
+        return handle_imgtocsv(req, output_dir)
+    elif action == 'pdfcsv':
+        return handle_pdfcsv(req, output_dir)
+    else:
+        return handle_mergecsv(req, data_dir, output_dir)
+
 def handle_imgtocsv(req: func.HttpRequest, output_dir: str) -> func.HttpResponse:
     """Handle image to CSV conversion"""
     # Check if there's a file in the request
@@ -256,6 +288,15 @@ def handle_mergecsv(req: func.HttpRequest, data_dir: str, output_dir: str) -> fu
     base_file = req.files.get('base_file')
     new_file = req.files.get('new_file')
 
+    # Optional upsert keys, e.g. key_columns=Roll Number,Subject
+    key_columns = req.params.get('key_columns')
+    if not key_columns:
+        try:
+            req_body = req.get_json()
+            key_columns = req_body.get('key_columns')
+        except ValueError:
+            pass
+
     # If no files, try to get input_path from params or body
     if not base_file or not new_file:
         input_path = req.params.get('input_path')
@@ -297,7 +338,7 @@ def handle_mergecsv(req: func.HttpRequest, data_dir: str, output_dir: str) -> fu
 
     # Process the CSV
     try:
-        matcher = CSVMatcher(data_dir=data_dir, output_dir=output_dir)
+        matcher = CSVMatcher(data_dir=data_dir, output_dir=output_dir, key_columns=key_columns)
         merged_files = matcher.match_input_csv(temp_input_path)
 
         if merged_files and len(merged_files) > 0:
@@ -317,7 +358,9 @@ def handle_mergecsv(req: func.HttpRequest, data_dir: str, output_dir: str) -> fu
                 mimetype="text/csv",
                 headers={
                     "Access-Control-Allow-Origin": "*",
-                    "Content-Disposition": f"attachment; filename={os.path.basename(merged_files[0])}"
+                    "Access-Control-Expose-Headers": "X-Merge-Stats",
+                    "Content-Disposition": f"attachment; filename={os.path.basename(merged_files[0])}",
+                    "X-Merge-Stats": json.dumps(matcher.merge_stats.get(merged_files[0], {}))
                 }
             )
         else: